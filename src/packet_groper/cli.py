@@ -23,7 +23,8 @@ def cmd_scan(args: argparse.Namespace) -> int:
         # Scan the network
         num_hosts = subnet.num_addresses - 2
         print(f"Scanning {num_hosts} hosts...")
-        result = scan_network(subnet)
+        method = "icmp" if args.disable_arp_ping else args.method
+        result = scan_network(subnet, method=method)
 
         # Print report
         print()
@@ -61,9 +62,24 @@ def main() -> None:
         help="Subnet to scan (default: auto-discover)",
         default=None,
     )
+    scan_parser.add_argument(
+        "--method",
+        choices=["auto", "arp", "icmp"],
+        default="auto",
+        help="How to probe hosts: ARP (local subnet only), ICMP ping, "
+             "or auto to use ARP on the local subnet when possible (default: auto)",
+    )
+    scan_parser.add_argument(
+        "--disable-arp-ping",
+        action="store_true",
+        help="Never use ARP, only ICMP ping (same as --method icmp)",
+    )
 
     args = parser.parse_args()
 
+    if args.command == "scan" and args.disable_arp_ping and args.method == "arp":
+        scan_parser.error("--disable-arp-ping cannot be used with --method arp")
+
     if args.command == "scan":
         sys.exit(cmd_scan(args))
     else:
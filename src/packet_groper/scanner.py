@@ -1,13 +1,43 @@
 """Network scanning functionality for packet-groper."""
 
+import collections.abc
+import ctypes
+import platform
+import random
+import re
+import resource
+import selectors
 import subprocess
 import socket
 import struct
+import sys
 import fcntl
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from dataclasses import dataclass, field
 from ipaddress import IPv4Network, IPv4Address
-from typing import List, Optional
+from typing import Dict, Iterator, List, Optional, Sequence, Union
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+SO_ATTACH_FILTER = 26  # Linux
+
+ETH_P_ARP = 0x0806
+ETH_P_IP = 0x0800
+ARPHRD_ETHER = 1
+ARP_REQUEST = 1
+ARP_REPLY = 2
+SIOCGIFADDR = 0x8915
+SIOCGIFNETMASK = 0x891B
+SIOCGIFHWADDR = 0x8927
+
+_IS_DARWIN = platform.system() == "Darwin"
+
+# Pause between probes so a sweep doesn't flood the link
+_SEND_INTERVAL = 0.0001
+# How often the receiver checks whether the sender has finished
+_POLL_INTERVAL = 0.05
 
 
 class NetworkError(Exception):
@@ -18,14 +48,54 @@ class NetworkError(Exception):
         super().__init__(message)
 
 
+class _Addresses(collections.abc.Sequence):
+    """Read-only sequence of IPv4Address over a sequence of integer addresses.
+
+    Addresses are only built when accessed, so a /22 scan doesn't have to
+    create a thousand address objects just to record what it scanned.
+    """
+
+    def __init__(self, addresses: Sequence[int]):
+        self._addresses = addresses
+
+    def __len__(self) -> int:
+        return len(self._addresses)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return _Addresses(self._addresses[index])
+        return IPv4Address(self._addresses[index])
+
+    def __iter__(self) -> Iterator[IPv4Address]:
+        return map(IPv4Address, self._addresses)
+
+    def __contains__(self, ip) -> bool:
+        return isinstance(ip, IPv4Address) and int(ip) in self._addresses
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, _Addresses):
+            return list(self._addresses) == list(other._addresses)
+        # Compare like the lists these fields used to be
+        return isinstance(other, list) and list(self) == other
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+
 @dataclass
 class ScanResult:
-    """Results from a network scan."""
+    """Results from a network scan.
+
+    hosts_scanned and dead are read-only sequences, not lists. Each
+    IPv4Address is built as it is read. They can be iterated, indexed,
+    sliced, searched with `in` and compared with lists, but not appended
+    to. alive is a plain list.
+    """
 
     subnet: IPv4Network
-    hosts_scanned: List[IPv4Address] = field(default_factory=list)
+    hosts_scanned: Sequence[IPv4Address] = field(default_factory=list)
     alive: List[IPv4Address] = field(default_factory=list)
-    dead: List[IPv4Address] = field(default_factory=list)
+    dead: Sequence[IPv4Address] = field(default_factory=list)
 
     def report(self) -> str:
         """Generate a human-readable report of scan results."""
@@ -38,21 +108,21 @@ class ScanResult:
             "",
             "Alive hosts:",
         ]
-        for host in sorted(self.alive):
-            lines.append(f"  {host}")
+        lines.extend([f"  {host}" for host in sorted(self.alive)])
         return "\n".join(lines)
 
 
 def get_interfaces() -> List[str]:
-    """Get list of active network interfaces."""
+    """Get the active network interface carrying the default route."""
     interfaces = []
     try:
         with open("/proc/net/route") as f:
-            for line in f.readlines()[1:]:
-                parts = line.strip().split()
-                if parts[1] != "00000000":  # Skip default route
-                    continue
-                interfaces.append(parts[0])
+            next(f, None)  # Skip header
+            for line in f:
+                parts = line.split()
+                if parts[1] == "00000000":  # Default route
+                    interfaces.append(parts[0])
+                    break
     except FileNotFoundError:
         # macOS fallback - use socket to find default interface
         try:
@@ -78,10 +148,26 @@ def _get_local_ip() -> Optional[str]:
         return None
 
 
-def _get_netmask() -> Optional[str]:
-    """Get the netmask for the default interface."""
+def _netmask_for(interface: str) -> Optional[str]:
+    """Read an interface's netmask straight from the kernel (Linux)."""
+    ifreq = struct.pack("256s", interface[:15].encode())
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        try:
+            packed = fcntl.ioctl(s.fileno(), SIOCGIFNETMASK, ifreq)
+        except OSError:
+            return None
+    return socket.inet_ntoa(packed[20:24])
+
+
+def _get_netmask(interface: str) -> Optional[str]:
+    """Get the netmask for the given interface."""
+    if sys.platform.startswith("linux"):
+        mask = _netmask_for(interface)
+        if mask:
+            return mask
+
     try:
-        # Try using ifconfig on macOS
+        # Fall back to parsing ifconfig (macOS)
         result = subprocess.run(
             ["ifconfig"],
             capture_output=True,
@@ -92,23 +178,18 @@ def _get_netmask() -> Optional[str]:
         if not local_ip:
             return None
 
-        lines = result.stdout.split("\n")
-        for i, line in enumerate(lines):
-            if local_ip in line:
-                # Look for netmask in same or nearby lines
-                for j in range(max(0, i - 2), min(len(lines), i + 3)):
-                    if "netmask" in lines[j]:
-                        parts = lines[j].split()
-                        for k, part in enumerate(parts):
-                            if part == "netmask" and k + 1 < len(parts):
-                                mask = parts[k + 1]
-                                # Convert hex netmask to dotted decimal if needed
-                                if mask.startswith("0x"):
-                                    mask_int = int(mask, 16)
-                                    return socket.inet_ntoa(struct.pack(">I", mask_int))
-                                return mask
-        # Default to /24 if we can't determine
-        return "255.255.255.0"
+        match = re.search(
+            rf"inet {re.escape(local_ip)}\s+netmask\s+(0x[0-9a-fA-F]+|\d+\.\d+\.\d+\.\d+)",
+            result.stdout,
+        )
+        if not match:
+            # Default to /24 if we can't determine
+            return "255.255.255.0"
+        mask = match.group(1)
+        # Convert hex netmask to dotted decimal if needed
+        if mask.startswith("0x"):
+            return socket.inet_ntoa(struct.pack(">I", int(mask, 16)))
+        return mask
     except Exception:
         return "255.255.255.0"
 
@@ -137,7 +218,7 @@ def discover_subnet(interface: Optional[str] = "auto") -> IPv4Network:
     if not local_ip:
         raise NetworkError("no-interface", "Could not determine local IP address")
 
-    netmask = _get_netmask()
+    netmask = _get_netmask(interfaces[0])
     if not netmask:
         raise NetworkError("no-interface", "Could not determine network mask")
 
@@ -146,6 +227,229 @@ def discover_subnet(interface: Optional[str] = "auto") -> IPv4Network:
     return network
 
 
+def _checksum(data: bytes) -> int:
+    """Compute the 16-bit ones-complement checksum used by ICMP."""
+    if len(data) % 2:
+        data += b"\x00"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+class _PingSocket:
+    """A single ICMP socket used to ping many hosts at once.
+
+    Echo requests carry a per-socket identifier and a sequence number, and
+    a reply only counts if it comes from the host that sequence number was
+    sent to, so concurrent or earlier scans can't claim each other's replies.
+    """
+
+    def __init__(self) -> None:
+        try:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+            self.raw = True
+        except PermissionError:
+            # Unprivileged ICMP sockets (Linux ping_group_range, macOS)
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+            self.raw = False
+        # Random rather than PID-based, so scans in one process don't share it
+        self.ident = random.getrandbits(16)
+        self._seq = 0
+        self._hosts: Dict[int, int] = {}
+        if self.raw and sys.platform.startswith("linux"):
+            self._attach_filter()
+
+    def _attach_filter(self) -> None:
+        """Have the kernel drop everything except echo replies carrying our ident.
+
+        A raw socket otherwise receives a copy of every ICMP packet the host
+        sees. If the filter can't be attached, read() still checks the ident.
+        """
+        program = [
+            (0xB1, 0, 0, 0),                # ldxb 4*([0]&0xf)  IP header length
+            (0x50, 0, 0, 0),                # ldb [x+0]         ICMP type
+            (0x15, 0, 3, ICMP_ECHO_REPLY),  # jeq #0 else drop
+            (0x48, 0, 0, 4),                # ldh [x+4]         ICMP identifier
+            (0x15, 0, 1, self.ident),       # jeq #ident else drop
+            (0x06, 0, 0, 0xFFFF),           # ret #0xffff       keep
+            (0x06, 0, 0, 0),                # ret #0            drop
+        ]
+        filters = ctypes.create_string_buffer(
+            b"".join(struct.pack("HBBI", *insn) for insn in program)
+        )
+        fprog = struct.pack("HL", len(program), ctypes.addressof(filters))
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+        except OSError:
+            pass
+
+    def __enter__(self) -> "_PingSocket":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.sock.close()
+
+    def fileno(self) -> int:
+        return self.sock.fileno()
+
+    def send(self, ip: int) -> None:
+        """Send one echo request to the integer address ip."""
+        self._seq = self._seq % 0xFFFF + 1
+        header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0, self.ident, self._seq)
+        packet = header[:2] + struct.pack("!H", _checksum(header)) + header[4:]
+        self._hosts[self._seq] = ip
+        try:
+            self.sock.sendto(packet, (socket.inet_ntoa(ip.to_bytes(4, "big")), 0))
+        except OSError:
+            pass  # Unreachable hosts are simply never marked alive
+
+    def read(self) -> Optional[int]:
+        """Read one packet and return the address it is a reply from, if any."""
+        data, addr = self.sock.recvfrom(1500)
+        # Raw sockets (and macOS datagram sockets) include the IP header
+        offset = (data[0] & 0x0F) * 4 if data[0] >> 4 == 4 else 0
+        if len(data) < offset + 8:
+            return None
+        icmp_type, _, _, ident, seq = struct.unpack_from("!BBHHH", data, offset)
+        if icmp_type != ICMP_ECHO_REPLY:
+            return None
+        # The kernel rewrites the identifier on datagram sockets
+        if self.raw and ident != self.ident:
+            return None
+        ip = self._hosts.get(seq)
+        if ip is None or int.from_bytes(socket.inet_aton(addr[0]), "big") != ip:
+            return None
+        return ip
+
+
+class _ArpSocket:
+    """A raw link-layer socket used to send ARP who-has requests (Linux only).
+
+    Every host has to answer ARP for its own address, so this also finds
+    hosts that drop pings, but only on the directly-connected subnet.
+    """
+
+    def __init__(self, interface: str) -> None:
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ARP))
+        try:
+            self.sock.bind((interface, ETH_P_ARP))
+            ifreq = struct.pack("256s", interface[:15].encode())
+            hwaddr = fcntl.ioctl(self.sock.fileno(), SIOCGIFHWADDR, ifreq)
+            # Layer-3 links (tun, WireGuard) have no Ethernet ARP to speak
+            family = struct.unpack_from("H", hwaddr, 16)[0]
+            if family != ARPHRD_ETHER:
+                raise OSError(f"{interface} is not an Ethernet interface (hardware type {family})")
+            self.mac = hwaddr[18:24]
+            self.ip = fcntl.ioctl(self.sock.fileno(), SIOCGIFADDR, ifreq)[20:24]
+        except OSError:
+            self.sock.close()
+            raise
+        # Everything but the target address is the same in every request
+        self._request = (
+            b"\xff" * 6 + self.mac + struct.pack("!H", ETH_P_ARP)
+            + struct.pack("!HHBBH6s4s6s", ARPHRD_ETHER, ETH_P_IP, 6, 4, ARP_REQUEST,
+                          self.mac, self.ip, b"\x00" * 6)
+        )
+
+    def __enter__(self) -> "_ArpSocket":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.sock.close()
+
+    def fileno(self) -> int:
+        return self.sock.fileno()
+
+    def send(self, ip: int) -> None:
+        """Broadcast an ARP request for the integer address ip."""
+        try:
+            self.sock.send(self._request + ip.to_bytes(4, "big"))
+        except OSError:
+            pass
+
+    def read(self) -> Optional[int]:
+        """Read one frame and return the sender address if it is an ARP reply."""
+        frame = self.sock.recv(1500)
+        if len(frame) < 42 or struct.unpack_from("!H", frame, 20)[0] != ARP_REPLY:
+            return None
+        return int.from_bytes(frame[28:32], "big")
+
+
+def _host_range(subnet: IPv4Network) -> range:
+    """Integer addresses of the hosts subnet.hosts() would yield."""
+    first = int(subnet.network_address)
+    last = int(subnet.broadcast_address)
+    if subnet.prefixlen < 31:  # /31 and /32 have no network or broadcast address
+        first += 1
+        last -= 1
+    return range(first, last + 1)
+
+
+def _chunks(hosts: range, size: int) -> Iterator[range]:
+    """Split hosts into consecutive ranges of at most size addresses."""
+    for start in range(0, len(hosts), size):
+        yield hosts[start:start + size]
+
+
+def _sweep(
+    sock: Union[_PingSocket, _ArpSocket],
+    hosts: range,
+    timeout: float,
+    group_size: int,
+) -> bytearray:
+    """Probe hosts over one socket, group_size hosts at a time.
+
+    Each group's replies are collected before the next group is sent, which
+    keeps the burst of outstanding probes small enough not to get dropped.
+
+    Returns:
+        Bitmap with a nonzero byte for each host in hosts that answered.
+    """
+    alive = bytearray()
+    with selectors.DefaultSelector() as selector:
+        selector.register(sock, selectors.EVENT_READ)
+        for group in _chunks(hosts, max(1, group_size)):
+            alive += _sweep_group(sock, selector, group, timeout)
+    return alive
+
+
+def _sweep_group(
+    sock: Union[_PingSocket, _ArpSocket],
+    selector: selectors.BaseSelector,
+    hosts: range,
+    timeout: float,
+) -> bytearray:
+    """Probe every host over one socket and collect the ones that answer.
+
+    A sender thread paces out one probe per host while this thread reads
+    replies, until timeout seconds after the last probe was sent.
+    """
+    def send_all() -> None:
+        for ip in hosts:
+            sock.send(ip)
+            time.sleep(_SEND_INTERVAL)
+
+    sender = threading.Thread(target=send_all, daemon=True)
+    sender.start()
+
+    alive = bytearray(len(hosts))
+    deadline = None
+    while True:
+        if deadline is None and not sender.is_alive():
+            deadline = time.monotonic() + timeout
+        remaining = _POLL_INTERVAL if deadline is None else deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        for key, _ in selector.select(timeout=remaining):
+            ip = key.fileobj.read()
+            if ip is not None and ip in hosts:
+                alive[ip - hosts.start] = 1
+
+    sender.join()
+    return alive
+
+
 def _ping_host(ip: IPv4Address, timeout: float = 0.5) -> bool:
     """Ping a single host to check if it's alive.
 
@@ -159,11 +463,7 @@ def _ping_host(ip: IPv4Address, timeout: float = 0.5) -> bool:
     try:
         # Use system ping command with short timeout
         # macOS uses -W in ms, Linux uses -W in seconds
-        import platform
-        if platform.system() == "Darwin":
-            timeout_arg = str(int(timeout * 1000))  # macOS: milliseconds
-        else:
-            timeout_arg = str(int(timeout))  # Linux: seconds
+        timeout_arg = str(int(timeout * 1000)) if _IS_DARWIN else str(int(timeout))
 
         result = subprocess.run(
             ["ping", "-c", "1", "-W", timeout_arg, str(ip)],
@@ -177,45 +477,143 @@ def _ping_host(ip: IPv4Address, timeout: float = 0.5) -> bool:
         return False
 
 
+def _ping_sweep(hosts: range, timeout: float, max_workers: int) -> bytearray:
+    """Ping hosts with the system ping command, for when no ICMP socket is available."""
+    # Each ping in flight holds a few descriptors for its output pipes
+    fd_limit, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if fd_limit != resource.RLIM_INFINITY:
+        max_workers = max(1, min(max_workers, fd_limit // 4))
+
+    alive = bytearray(len(hosts))
+    queued = iter(hosts)
+    # Only keep max_workers pings submitted at a time, topping up as they finish
+    pending: Dict[Future, int] = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        def submit_next() -> None:
+            ip = next(queued, None)
+            if ip is not None:
+                pending[executor.submit(_ping_host, IPv4Address(ip), timeout)] = ip
+
+        for _ in range(max_workers):
+            submit_next()
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                ip = pending.pop(future)
+                try:
+                    if future.result():
+                        alive[ip - hosts.start] = 1
+                except Exception:
+                    pass
+                submit_next()
+    return alive
+
+
+def _icmp_scan(hosts: range, timeout: float, group_size: int, max_workers: int) -> bytearray:
+    """Find alive hosts with ICMP echo, using the ping command if no ICMP socket is available."""
+    try:
+        sock = _PingSocket()
+    except OSError:
+        return _ping_sweep(hosts, timeout, max_workers)
+    with sock:
+        return _sweep(sock, hosts, timeout, group_size)
+
+
+def _arp_scan(hosts: range, timeout: float, group_size: int) -> Optional[bytearray]:
+    """Find alive hosts with ARP on the default interface.
+
+    Returns:
+        Bitmap of the hosts that answered, or None if ARP scanning isn't
+        possible here (not Linux, not root, or no usable interface).
+    """
+    interfaces = get_interfaces()
+    if not hasattr(socket, "AF_PACKET") or not interfaces:
+        return None
+    try:
+        sock = _ArpSocket(interfaces[0])
+    except OSError:
+        return None
+    with sock:
+        alive = _sweep(sock, hosts, timeout, group_size)
+    # We never get an ARP reply from ourselves
+    local_ip = int.from_bytes(sock.ip, "big")
+    if local_ip in hosts:
+        alive[local_ip - hosts.start] = 1
+    return alive
+
+
+def _is_on_link(subnet: IPv4Network) -> bool:
+    """Check whether subnet lies within the local, directly-connected subnet."""
+    try:
+        return subnet.subnet_of(discover_subnet())
+    except NetworkError:
+        return False
+
+
 def scan_network(
     subnet: IPv4Network,
     timeout: float = 0.5,
     max_workers: int = 100,
+    group_size: int = 256,
+    method: str = "auto",
 ) -> ScanResult:
     """Scan all hosts in a subnet to find alive hosts.
 
+    With method "auto", hosts on the directly-connected subnet are probed
+    with ARP when possible, since firewalled hosts still answer it, and
+    anything else is probed with ICMP echo.
+
     Args:
         subnet: The subnet to scan (must be /22 or smaller).
-        timeout: Ping timeout per host in seconds.
-        max_workers: Maximum concurrent ping threads.
+        timeout: Seconds to wait for replies after the last probe is sent.
+        max_workers: Maximum concurrent ping processes, used only when no
+                     ICMP socket can be opened and the ping command is used.
+        group_size: Number of hosts probed at once. Each group's replies
+                    are collected before the next group is probed.
+        method: "auto", "arp" to always use ARP, or "icmp" to always ping.
 
     Returns:
         ScanResult containing alive and dead hosts.
 
     Raises:
-        NetworkError: If subnet is larger than /22.
+        NetworkError: If subnet is larger than /22, or ARP was requested
+                      for a subnet that isn't directly connected or on a
+                      system where it can't be used.
+        ValueError: If method is not one of "auto", "arp" or "icmp".
     """
+    if method not in ("auto", "arp", "icmp"):
+        raise ValueError(f"Unknown scan method: {method!r}")
     if subnet.prefixlen < 22:
         raise NetworkError(
             "unsupported-subnet",
             f"Only /22 or smaller subnets are supported, got /{subnet.prefixlen}",
         )
 
-    result = ScanResult(subnet=subnet)
-    hosts = list(subnet.hosts())  # Excludes network and broadcast addresses
-    result.hosts_scanned = hosts
+    hosts = _host_range(subnet)  # Excludes network and broadcast addresses
 
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_ip = {executor.submit(_ping_host, ip, timeout): ip for ip in hosts}
-
-        for future in as_completed(future_to_ip):
-            ip = future_to_ip[future]
-            try:
-                if future.result():
-                    result.alive.append(ip)
-                else:
-                    result.dead.append(ip)
-            except Exception:
-                result.dead.append(ip)
+    if method == "arp" and not _is_on_link(subnet):
+        raise NetworkError(
+            "scan-failed",
+            f"ARP only works on the local subnet, {subnet} is not directly connected",
+        )
+
+    alive = None
+    if method == "arp" or (method == "auto" and _is_on_link(subnet)):
+        alive = _arp_scan(hosts, timeout, group_size)
+        if alive is None and method == "arp":
+            raise NetworkError("scan-failed", "ARP scanning requires Linux and root privileges")
+    if alive is None:
+        alive = _icmp_scan(hosts, timeout, group_size, max_workers)
+
+    # Only build address objects for the hosts that answered
+    result = ScanResult(subnet=subnet, hosts_scanned=_Addresses(hosts))
+    dead = []
+    for ip, up in zip(hosts, alive):
+        if up:
+            result.alive.append(IPv4Address(ip))  # Sweep order keeps alive sorted
+        else:
+            dead.append(ip)
+    result.dead = _Addresses(dead)
 
     return result
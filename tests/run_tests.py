@@ -8,13 +8,41 @@ Run from project root:
     python tests/run_tests.py
 """
 
+import functools
 import importlib
 import re
+import shlex
+import shutil
 import subprocess
 import sys
+import types
 from dataclasses import dataclass
 from pathlib import Path
 
+_FRONTMATTER_RE = re.compile(r'^```toml\n(.*?)```', re.DOTALL)
+# Section and test headers, and test code blocks: the opening fence, the
+# body up to the next line starting with ```, and that closing line
+_MARKDOWN_RE = re.compile(
+    r'^## (?P<section>.*)$'
+    r'|^### (?P<name>.*)$'
+    r'|^```(?P<lang>py|sh|python|bash)[ \t\r\f\v]*$\n?'
+    r'(?P<body>(?:(?!```)[^\n]*\n)*(?:(?!```)[^\n]+\Z)?)'
+    r'(?:```[^\n]*)?',
+    re.MULTILINE,
+)
+_EXPECT_RE = re.compile(r'#\s*expect:\s*(.+)$')
+_ERROR_RE = re.compile(r'#\s*error:\s*(.+)$')
+_EXIT_RE = re.compile(r'^#\s*exit:\s*(\d+)$')
+_STDOUT_RE = re.compile(r'^#\s*stdout:\s*(.+)$')
+_STDERR_RE = re.compile(r'^#\s*stderr:\s*(.+)$')
+_APPROX_RE = re.compile(r'approx\(([^,]+),\s*tol=([^)]+)\)')
+_CONTAINS_RE = re.compile(r'contains\("([^"]+)"\)')
+_ERROR_CODE_RE = re.compile(r'\[([^\]]+)\]')
+
+# Characters that need a real shell to interpret (pipes, redirects, globs,
+# comments, ...)
+_SHELL_CHARS = frozenset(';|&$`<>()*?[~#\n')
+
 
 @dataclass
 class TestCase:
@@ -24,6 +52,7 @@ class TestCase:
     language: str
     assertions: list[dict]
     line_number: int
+    code_obj: types.CodeType | None = None
 
 
 @dataclass
@@ -37,7 +66,7 @@ class TestResult:
 def parse_frontmatter(content: str) -> dict:
     """Extract TOML-like config from the start of the file."""
     config = {}
-    match = re.match(r'^```toml\n(.*?)```', content, re.DOTALL)
+    match = _FRONTMATTER_RE.match(content)
     if match:
         for line in match.group(1).strip().split('\n'):
             line = line.strip()
@@ -55,103 +84,126 @@ def parse_frontmatter(content: str) -> dict:
     return config
 
 
-def extract_tests(content: str) -> list[TestCase]:
+def compile_snippet(source: str, filename: str, mode: str) -> types.CodeType | None:
+    """Compile a snippet ahead of time.
+
+    Returns None if it doesn't compile, so the SyntaxError is reported when
+    the test runs rather than while the file is being parsed.
+    """
+    try:
+        return compile(source, filename, mode)
+    except SyntaxError:
+        return None
+
+
+def _parse_block(language: str, lines: list[str], first_line: int,
+                 filename: str) -> tuple[list[str], list[dict]]:
+    """Split a code block's lines into code and assertions."""
+    code_lines = []
+    assertions = []
+
+    for offset, code_line in enumerate(lines):
+        # Check for assertions in comments
+        if language == 'py':
+            expect_match = _EXPECT_RE.search(code_line)
+            error_match = _ERROR_RE.search(code_line)
+            snippet_name = f"<{filename}:{first_line + offset}>"
+
+            if expect_match:
+                # Get the expression before the comment
+                expr = code_line[:expect_match.start()].strip()
+                assertions.append({
+                    'type': 'expect',
+                    'expression': expr,
+                    'expr_obj': compile_snippet(expr, snippet_name, 'eval'),
+                    'expected': expect_match.group(1).strip(),
+                    'line': code_line
+                })
+            elif error_match:
+                expr = code_line[:error_match.start()].strip()
+                assertions.append({
+                    'type': 'error',
+                    'expression': expr,
+                    'expr_obj': compile_snippet(expr, snippet_name, 'exec'),
+                    'expected': error_match.group(1).strip(),
+                    'line': code_line
+                })
+            else:
+                code_lines.append(code_line)
+        elif language == 'sh':
+            # Shell assertions come after the command
+            exit_match = _EXIT_RE.match(code_line)
+            stdout_match = _STDOUT_RE.match(code_line)
+            stderr_match = _STDERR_RE.match(code_line)
+
+            if exit_match:
+                assertions.append({
+                    'type': 'exit',
+                    'expected': int(exit_match.group(1))
+                })
+            elif stdout_match:
+                assertions.append({
+                    'type': 'stdout',
+                    'expected': stdout_match.group(1).strip()
+                })
+            elif stderr_match:
+                assertions.append({
+                    'type': 'stderr',
+                    'expected': stderr_match.group(1).strip()
+                })
+            else:
+                code_lines.append(code_line)
+
+    return code_lines, assertions
+
+
+def extract_tests(content: str, filename: str = "<markdown>") -> list[TestCase]:
     """Find code blocks and their assertions from markdown."""
     tests = []
     current_section = ""
     current_test_name = ""
 
-    lines = content.split('\n')
-    i = 0
-    line_number = 0
-
-    while i < len(lines):
-        line = lines[i]
-        line_number = i + 1
-
-        # Track section headers
-        if line.startswith('## '):
-            current_section = line[3:].strip()
-        elif line.startswith('### '):
-            current_test_name = line[4:].strip()
-
-        # Find code blocks
-        code_match = re.match(r'^```(py|sh|python|bash)\s*$', line)
-        if code_match:
-            language = code_match.group(1)
-            if language == 'python':
-                language = 'py'
-            if language == 'bash':
-                language = 'sh'
-
-            code_lines = []
-            assertions = []
-            i += 1
-
-            while i < len(lines) and not lines[i].startswith('```'):
-                code_line = lines[i]
-
-                # Check for assertions in comments
-                if language == 'py':
-                    expect_match = re.search(r'#\s*expect:\s*(.+)$', code_line)
-                    error_match = re.search(r'#\s*error:\s*(.+)$', code_line)
-
-                    if expect_match:
-                        # Get the expression before the comment
-                        expr = code_line.split('#')[0].strip()
-                        assertions.append({
-                            'type': 'expect',
-                            'expression': expr,
-                            'expected': expect_match.group(1).strip(),
-                            'line': code_line
-                        })
-                    elif error_match:
-                        expr = code_line.split('#')[0].strip()
-                        assertions.append({
-                            'type': 'error',
-                            'expression': expr,
-                            'expected': error_match.group(1).strip(),
-                            'line': code_line
-                        })
-                    else:
-                        code_lines.append(code_line)
-                elif language == 'sh':
-                    # Shell assertions come after the command
-                    exit_match = re.match(r'^#\s*exit:\s*(\d+)$', code_line)
-                    stdout_match = re.match(r'^#\s*stdout:\s*(.+)$', code_line)
-                    stderr_match = re.match(r'^#\s*stderr:\s*(.+)$', code_line)
-
-                    if exit_match:
-                        assertions.append({
-                            'type': 'exit',
-                            'expected': int(exit_match.group(1))
-                        })
-                    elif stdout_match:
-                        assertions.append({
-                            'type': 'stdout',
-                            'expected': stdout_match.group(1).strip()
-                        })
-                    elif stderr_match:
-                        assertions.append({
-                            'type': 'stderr',
-                            'expected': stderr_match.group(1).strip()
-                        })
-                    else:
-                        code_lines.append(code_line)
-
-                i += 1
-
-            if assertions:
-                tests.append(TestCase(
-                    name=current_test_name or f"Test at line {line_number}",
-                    section=current_section,
-                    code='\n'.join(code_lines),
-                    language=language,
-                    assertions=assertions,
-                    line_number=line_number
-                ))
-
-        i += 1
+    # One scan over the file picks out headers and whole code blocks;
+    # everything else (prose, other fences) is skipped by the regex
+    line_number = 1
+    position = 0
+
+    for match in _MARKDOWN_RE.finditer(content):
+        line_number += content.count('\n', position, match.start())
+        position = match.start()
+
+        if match.lastgroup == 'section':
+            current_section = match.group('section').strip()
+            continue
+        if match.lastgroup == 'name':
+            current_test_name = match.group('name').strip()
+            continue
+
+        language = match.group('lang')
+        if language == 'python':
+            language = 'py'
+        if language == 'bash':
+            language = 'sh'
+
+        body = match.group('body')
+        lines = body.split('\n')
+        if not body or body.endswith('\n'):
+            lines.pop()
+
+        code_lines, assertions = _parse_block(language, lines, line_number + 1, filename)
+
+        if assertions:
+            code = '\n'.join(code_lines)
+            tests.append(TestCase(
+                name=current_test_name or f"Test at line {line_number}",
+                section=current_section,
+                code=code,
+                language=language,
+                assertions=assertions,
+                line_number=line_number,
+                code_obj=(compile_snippet(code, f"<{filename}:{line_number}>", 'exec')
+                          if language == 'py' else None)
+            ))
 
     return tests
 
@@ -161,7 +213,7 @@ def parse_expected_value(expected: str, actual):
     expected = expected.strip()
 
     # Handle approx() matcher
-    approx_match = re.match(r'approx\(([^,]+),\s*tol=([^)]+)\)', expected)
+    approx_match = _APPROX_RE.match(expected)
     if approx_match:
         target = float(approx_match.group(1))
         tolerance = float(approx_match.group(2))
@@ -170,7 +222,7 @@ def parse_expected_value(expected: str, actual):
         return False
 
     # Handle contains() matcher
-    contains_match = re.match(r'contains\("([^"]+)"\)', expected)
+    contains_match = _CONTAINS_RE.match(expected)
     if contains_match:
         substring = contains_match.group(1)
         return substring in str(actual)
@@ -212,7 +264,7 @@ def run_python_test(test: TestCase, module_imports: dict) -> TestResult:
     setup_code = test.code
     if setup_code.strip():
         try:
-            exec(setup_code, context)
+            exec(test.code_obj or setup_code, context)
         except Exception as e:
             return TestResult(
                 test=test,
@@ -228,7 +280,7 @@ def run_python_test(test: TestCase, module_imports: dict) -> TestResult:
             expected = assertion['expected']
 
             try:
-                actual = eval(expr, context)
+                actual = eval(assertion['expr_obj'] or expr, context)
                 if parse_expected_value(expected, actual):
                     continue
                 else:
@@ -251,11 +303,11 @@ def run_python_test(test: TestCase, module_imports: dict) -> TestResult:
             expected_code = assertion['expected']
 
             # Extract error code from [code] format
-            code_match = re.match(r'\[([^\]]+)\]', expected_code)
+            code_match = _ERROR_CODE_RE.match(expected_code)
             expected_error_code = code_match.group(1) if code_match else expected_code
 
             try:
-                exec(expr, context)
+                exec(assertion['expr_obj'] or expr, context)
                 return TestResult(
                     test=test,
                     passed=False,
@@ -278,14 +330,29 @@ def run_python_test(test: TestCase, module_imports: dict) -> TestResult:
     return TestResult(test=test, passed=True, message="OK")
 
 
+def split_simple_command(command: str) -> list[str] | None:
+    """Split command into argv if it can be run without a shell, else None."""
+    if any(ch in _SHELL_CHARS for ch in command):
+        return None
+    try:
+        argv = shlex.split(command)
+    except ValueError:
+        return None
+    # Leave env assignments and builtins/missing programs to the shell
+    if not argv or '=' in argv[0] or shutil.which(argv[0]) is None:
+        return None
+    return argv
+
+
 def run_shell_test(test: TestCase) -> TestResult:
     """Execute a shell command and validate assertions."""
     command = test.code.strip()
+    argv = split_simple_command(command)
 
     try:
         result = subprocess.run(
-            command,
-            shell=True,
+            argv if argv is not None else command,
+            shell=argv is None,
             capture_output=True,
             text=True,
             timeout=30
@@ -316,7 +383,7 @@ def run_shell_test(test: TestCase) -> TestResult:
 
         elif assertion['type'] == 'stdout':
             expected = assertion['expected']
-            contains_match = re.match(r'contains\("([^"]+)"\)', expected)
+            contains_match = _CONTAINS_RE.match(expected)
             if contains_match:
                 substring = contains_match.group(1)
                 if substring not in result.stdout:
@@ -329,7 +396,7 @@ def run_shell_test(test: TestCase) -> TestResult:
 
         elif assertion['type'] == 'stderr':
             expected = assertion['expected']
-            contains_match = re.match(r'contains\("([^"]+)"\)', expected)
+            contains_match = _CONTAINS_RE.match(expected)
             if contains_match:
                 substring = contains_match.group(1)
                 if substring not in result.stderr:
@@ -343,34 +410,41 @@ def run_shell_test(test: TestCase) -> TestResult:
     return TestResult(test=test, passed=True, message="OK")
 
 
-def load_module_imports(config: dict) -> dict:
-    """Load the module and imports specified in config."""
-    imports = {}
-
-    module_name = config.get('module')
-    import_names = config.get('import', [])
-
-    if not module_name:
-        return imports
+@functools.lru_cache(maxsize=None)
+def _load_imports_cached(module_name: str, import_names: tuple[str, ...]) -> tuple[tuple[str, object], ...]:
+    """Import a module once and look up the requested names in it."""
+    imports = []
 
     try:
         module = importlib.import_module(module_name)
         for name in import_names:
             if hasattr(module, name):
-                imports[name] = getattr(module, name)
+                imports.append((name, getattr(module, name)))
             else:
                 print(f"  Warning: {name} not found in {module_name}")
     except ImportError as e:
         print(f"  Warning: Could not import {module_name}: {e}")
 
-    return imports
+    return tuple(imports)
+
+
+def load_module_imports(config: dict) -> dict:
+    """Load the module and imports specified in config."""
+    module_name = config.get('module')
+    import_names = config.get('import', [])
+
+    if not module_name:
+        return {}
+
+    # Cached across test files; each caller gets its own dict to mutate
+    return dict(_load_imports_cached(module_name, tuple(import_names)))
 
 
 def run_test_file(path: Path) -> tuple[int, int]:
     """Run all tests in a markdown file. Returns (passed, failed) counts."""
     content = path.read_text()
     config = parse_frontmatter(content)
-    tests = extract_tests(content)
+    tests = extract_tests(content, path.name)
 
     print(f"\n{'='*60}")
     print(f"  {path.name}")